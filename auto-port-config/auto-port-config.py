@@ -1,32 +1,184 @@
-#!/usr/bin/env python
+#!/usr/bin/env python3
 
 """Auto Port Config
 This python script will configure interfaces based on the full mac address or OUI (Organizationally Unique Identifier). 
 The script can be run remotely, or on the switch itself, it can also be automatically called when a device is plugged 
 into the switch using the Event Handler.
+
+Requires Python 3.7 or newer.
 """
 
 
-from __future__ import print_function
 import argparse
 import sys
-from jsonrpclib import Server
+import base64
+import http.client
+import socket
 import ssl
-import collections
+import dataclasses
+import hashlib
+import logging
 import os
+import pickle
+import re
+import selectors
+import tempfile
 import time
 
 try:
-    _create_unverified_https_context = ssl._create_unverified_context
-except AttributeError:
-    # Legacy Python that doesn't verify HTTPS certificates by default
-    pass
-else:
-    # Handle target environment that doesn't support HTTPS verification
-    ssl._create_default_https_context = _create_unverified_https_context
+    import orjson
+    _json_dumps = orjson.dumps
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+
+    def _json_dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+
+    _json_loads = json.loads
+
+try:
+    import xxhash
+    _CONFIG_HASH = "xxh3_64"
+
+    def _hash_bytes(data):
+        return xxhash.xxh3_64(data).intdigest()
+except ImportError:
+    _CONFIG_HASH = "blake2b_64"
+
+    def _hash_bytes(data):
+        return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+# Seconds to wait for the switch to answer an eAPI call
+_EAPI_TIMEOUT = 30
+
+class EapiError(Exception):
+    """Raised when the switch returns a JSON-RPC error for a command"""
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection over a unix socket, used to reach eAPI on the switch itself.
+
+    Parameters
+    ----------
+    _socket_path : str
+        Path to the unix socket
+    _timeout : float, optional
+        Seconds to wait on the socket before giving up
+    """
+
+    def __init__(self, _socket_path, _timeout=None):
+        http.client.HTTPConnection.__init__(self, "localhost", timeout=_timeout)
+        self.socket_path = _socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+class EapiClient():
+    """Small eAPI client exposing the same `runCmds` call as `jsonrpclib.Server`.
+
+    Remote switches are reached over HTTPS, the local switch is reached over the unix socket. The connection is kept
+    open between calls so a long running process only pays for the connection setup once. A call that gets no answer
+    from the switch within `_EAPI_TIMEOUT` seconds fails with a timeout, so a hung switch can't block the daemon.
+
+    Parameters
+    ----------
+    _address : str, optional
+        The username password and address to the switch. username:password@ipaddress. Uses the local unix socket if
+        not set.
+    _cafile : str, optional
+        Certificate to verify the switch against. The switch certificate must be signed by it, the hostname is not
+        checked. The switch certificate is not verified if not set, as switches usually have a self signed certificate.
+    """
+
+    def __init__(self, _address=None, _cafile=None):
+        self.headers = {"Content-Type": "application/json", "Connection": "keep-alive"}
+
+        if _address:
+            credentials, _, host = _address.rpartition("@")
+            if _cafile:
+                # Pin the certificate rather than check the hostname, switch certificates rarely list their address
+                context = ssl.create_default_context(cafile=_cafile)
+                context.check_hostname = False
+            else:
+                context = ssl._create_unverified_context()
+            self.connection = http.client.HTTPSConnection(host, timeout=_EAPI_TIMEOUT, context=context)
+            if credentials:
+                self.headers["Authorization"] = "Basic " + base64.b64encode(credentials.encode("utf-8")).decode("ascii")
+        else:
+            self.connection = UnixHTTPConnection("/var/run/command-api.sock", _EAPI_TIMEOUT)
 
-switch = Server( "unix:/var/run/command-api.sock")
-apply_default_config = False
+    def runCmds(self, version, cmds, format='json'):
+        body = _json_dumps({"jsonrpc": "2.0", "method": "runCmds", "params": {"version": version, "cmds": cmds, "format": format}, "id": 1})
+
+        try:
+            response = self.__post(body)
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # The switch closed the kept alive connection, reconnect and try once more. Timeouts are not retried, a
+            # switch that stopped answering would only be asked again.
+            self.connection.close()
+            response = self.__post(body)
+
+        data = response.read()
+
+        if response.status != 200:
+            raise http.client.HTTPException("{} {}".format(response.status, response.reason))
+
+        data = _json_loads(data)
+
+        if "error" in data:
+            raise EapiError(data["error"].get("message"))
+
+        return data["result"]
+
+    def __post(self, body):
+        self.connection.request("POST", "/command-api", body, self.headers)
+        return self.connection.getresponse()
+
+@dataclasses.dataclass
+class Ctx():
+    """Everything needed to check and configure interfaces, so a long running process can reuse it between events.
+
+    Attributes
+    ----------
+    switch : EapiClient
+        The connection to the switch
+    interface_config : array of lists
+        The config for the matching interfaces. Each config section is a index of the array stored in a list
+    index : dict
+        The lookup tables from `build_config_index`
+    """
+
+    switch: EapiClient
+    interface_config: list
+    index: dict
+
+log = logging.getLogger("autoport")
+
+# Bump when the layout of the cached config index changes
+_CACHE_VERSION = 4
+
+# Characters allowed in a cleaned mac address or OUI
+_HEX_DIGITS = frozenset("0123456789abcdef")
+
+# Delimiters stripped from mac addresses by clean_mac_address
+_MAC_DELETE = str.maketrans('', '', ':.-')
+
+# Seconds the daemon waits for more interfaces before checking them together
+_COALESCE_WINDOW = 0.02
+
+# Seconds a daemon client has to send its interface name
+_CLIENT_TIMEOUT = 5
+
+# Interface names accepted by the daemon. A single interface only, ranges like Ethernet1-48 are not accepted
+_INTERFACE_RE = re.compile(r'^[A-Za-z][A-Za-z-]*\d+(/\d+)*(\.\d+)?$')
+
+# Mac addresses as shown in the text output of `show mac address-table`
+_MAC_RE = re.compile(r'\b([0-9a-f]{4}\.[0-9a-f]{4}\.[0-9a-f]{4})\b', re.I)
+
+# Heading of the multicast section that follows the unicast table in `show mac address-table`
+_MULTICAST_HEADER = "Multicast Mac Address Table"
 
 def main():
     parser = argparse.ArgumentParser(description='Auto Port Config')
@@ -34,38 +186,331 @@ def main():
     interfaceInfo = parser.add_mutually_exclusive_group(required=True)
 
     interfaceInfo.add_argument('-i', action='store', dest='inter', help='Interface that has changed state')
+    interfaceInfo.add_argument('--daemon', action='store_true', dest='daemon', help='Keep running and check the interfaces sent to the socket set by -s')
 
     dir_path = os.path.dirname(os.path.realpath(__file__))
     parser.add_argument('-c', action='store', dest='config', default=dir_path + '/auto-port.conf', help='File containting the ouis and config to apply. Default is auto-port.conf in same dir as script')
     parser.add_argument('-a', action='store', dest='address', help='The username password and address to the switch. username:password@ipaddress')
+    parser.add_argument('--cafile', action='store', dest='cafile', help='Certificate to verify the switch with when using -a. The switch certificate is not verified by default')
+    parser.add_argument('-d', action='store_true', dest='debug', help='Print debug output')
+    parser.add_argument('-s', action='store', dest='socket', default='/var/run/auto-port.sock', help='Unix socket the daemon listens on. Default is /var/run/auto-port.sock')
 
     results = parser.parse_args()
 
-    if results.address:
-        global switch 
-        switch = Server("https://{}/command-api".format(results.address))
+    logging.basicConfig(format="%(message)s")
+    log.setLevel(logging.DEBUG if results.debug else logging.WARNING)
+
+    try:
+        interface_config, index = load_config(results.config)
+    except ValueError as e:
+        print("Error in config file {}: {}".format(results.config, e))
+        sys.exit(1)
+
+    ctx = Ctx(EapiClient(results.address, results.cafile), interface_config, index)
+
+    if results.daemon:
+        serve(results.socket, results.config, ctx)
+        return
+
+    try:
+        run_once(results.inter, ctx)
+    except EapiError as e:
+        print("Error from switch: {}".format(e))
+        sys.exit(1)
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        print("Error with connecting to switch! Please try again. ({})".format(e))
+        sys.exit(1)
+
+def serve(_socket_path, _config_file, _ctx):
+    """Runs as a daemon, checking each interface name sent as a line to a unix socket.
+
+    The config and the connection to the switch are kept between events. The config is loaded again when the config
+    file changes. Interfaces that arrive within `_COALESCE_WINDOW` of each other are checked together with a single
+    call to the switch. Each client gets back `ok configured`, `ok unchanged` or `error` with a reason.
+
+    Parameters
+    ----------
+    _socket_path : str
+        Path to the unix socket to listen on
+    _config_file : str
+        Path to the configuration file
+    _ctx : Ctx
+        The switch connection and loaded config
+    """
+
+    if os.path.exists(_socket_path):
+        os.remove(_socket_path)
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(_socket_path)
+    server.listen(16)
+
+    selector = selectors.DefaultSelector()
+    selector.register(server, selectors.EVENT_READ)
+
+    config_key = _config_key(_config_file)
+    clients = {}
+    pending = []
+    deadline = None
+
+    log.debug("Listening on %s", _socket_path)
+
+    try:
+        while True:
+            # Wake up for the end of the coalesce window or the first client that is too slow to send its interface
+            wakeups = [expires for _, expires in clients.values()]
+            if deadline is not None:
+                wakeups.append(deadline)
+            timeout = max(0, min(wakeups) - time.monotonic()) if wakeups else None
+
+            for selected, _ in selector.select(timeout):
+                if selected.fileobj is server:
+                    conn, _ = server.accept()
+                    conn.setblocking(False)
+                    selector.register(conn, selectors.EVENT_READ)
+                    clients[conn] = [b"", time.monotonic() + _CLIENT_TIMEOUT]
+                    continue
+
+                interface = _read_client(selected.fileobj, clients, selector)
+                if interface is None:
+                    continue
+
+                if not _INTERFACE_RE.match(interface):
+                    _reply(selected.fileobj, "error invalid interface {!r}".format(interface))
+                    continue
+
+                pending.append((selected.fileobj, interface))
+                if deadline is None:
+                    deadline = time.monotonic() + _COALESCE_WINDOW
+
+            now = time.monotonic()
+            for conn in [conn for conn, (_, expires) in clients.items() if expires <= now]:
+                del clients[conn]
+                selector.unregister(conn)
+                conn.close()
+
+            if deadline is None or now < deadline:
+                continue
+
+            # Interfaces can be sent more than once during the window, only check them once
+            interfaces = list(dict.fromkeys(interface for _, interface in pending))
+
+            try:
+                key = _config_key(_config_file)
+                if key != config_key:
+                    _ctx.interface_config, _ctx.index = load_config(_config_file)
+                    config_key = key
+
+                replies = _run_pending(interfaces, _ctx)
+            except (OSError, ValueError) as e:
+                log.warning("%s", e)
+                replies = dict.fromkeys(interfaces, "error {}".format(e))
+            except Exception as e:
+                # Keep the daemon running for the next events whatever went wrong with this one
+                log.exception("Error checking %s", ", ".join(interfaces))
+                replies = dict.fromkeys(interfaces, "error {}".format(e))
+
+            for conn, interface in pending:
+                _reply(conn, replies.get(interface, "error no result"))
+
+            pending = []
+            deadline = None
+    finally:
+        for conn in clients:
+            conn.close()
+        selector.close()
+        server.close()
+        os.remove(_socket_path)
+
+def _read_client(_conn, _clients, _selector):
+    """Reads what a daemon client has sent without blocking.
+
+    Returns the interface name once the client has sent a full line, or closed its side, and stops watching the
+    client. Returns None while the line is still incomplete, or if the client went away.
+    """
+
+    buffer = _clients[_conn][0]
+
+    try:
+        data = _conn.recv(256)
+    except BlockingIOError:
+        return None
+    except OSError:
+        data = None
+
+    if data:
+        buffer += data
+        if b"\n" not in buffer and len(buffer) < 256:
+            _clients[_conn][0] = buffer
+            return None
+
+    del _clients[_conn]
+    _selector.unregister(_conn)
+
+    if data is None:
+        _conn.close()
+        return None
+
+    _conn.settimeout(1)
+
+    return buffer.split(b"\n", 1)[0].decode("utf-8", "replace").strip()
+
+def _run_pending(_interfaces, _ctx):
+    """Checks the interfaces queued by the daemon and returns the reply for each one.
+
+    They are checked together first. If the switch returns an error, for example because one of the interfaces doesn't
+    exist, they are checked one at a time so only the failing interface gets an error. If the switch can't be reached
+    they all get the error, as retrying each one would only wait on the switch again.
+    """
+
+    try:
+        results = run_batch(_interfaces, _ctx)
+        return {interface: "ok configured" if configured else "ok unchanged" for interface, configured in results.items()}
+    except EapiError as e:
+        if len(_interfaces) == 1:
+            log.warning("%s: %s", _interfaces[0], e)
+            return {_interfaces[0]: "error {}".format(e)}
+    except (OSError, http.client.HTTPException, ValueError) as e:
+        log.warning("%s: %s", ", ".join(_interfaces), e)
+        return dict.fromkeys(_interfaces, "error {}".format(e))
+
+    replies = {}
+    for interface in _interfaces:
+        replies.update(_run_pending([interface], _ctx))
+
+    return replies
+
+def _reply(_conn, _message):
+    """Sends a reply line to a daemon client and closes the connection"""
+
+    with _conn:
+        try:
+            _conn.sendall((_message + "\n").encode("utf-8"))
+        except OSError:
+            pass
+
+def run_once(_interface, _ctx):
+    """Checks an interface and configures it if a matching config is found and it is not already applied.
+
+    Parameters
+    ----------
+    _interface : str
+        The interface to check
+    _ctx : Ctx
+        The switch connection and loaded config
+
+    Returns
+    ----------
+    Bool. True if the interface was configured.
+    """
+
+    return run_batch([_interface], _ctx)[_interface]
+
+def run_batch(_interfaces, _ctx):
+    """Checks interfaces and configures the ones with a matching config that is not already applied.
+
+    All of the interfaces are read with one call to the switch, and the ones that need it are configured with one more.
+
+    Parameters
+    ----------
+    _interfaces : list
+        The interfaces to check
+    _ctx : Ctx
+        The switch connection and loaded config
+
+    Returns
+    ----------
+    A dict of each interface and a bool, True if the interface was configured.
+    """
+
+    results = {}
+    configs = {}
+
+    for interface, (mac_table, running_config) in zip(_interfaces, fetch_interface_state(_ctx, _interfaces)):
+        results[interface] = False
+
+        mac_index = check_interface_macs(mac_table, _ctx.index)
+
+        if mac_index == -99:
+            log.debug("%s: no matching mac address or OUI and no default config", interface)
+            continue
+
+        # Check if the interface config matches the purposed config, nothing to do if it does.
+        if check_interface_config(running_config, _ctx.index['config_hashes'][mac_index]):
+            log.debug("%s: already has config %s", interface, mac_index)
+            continue
+
+        log.debug("%s: applying config %s", interface, mac_index)
+
+        configs[interface] = (_ctx.interface_config[mac_index], running_config_lines(running_config))
+
+    for interface in config_interface(_ctx, configs):
+        results[interface] = True
+
+    return results
+
+def load_config(_config_file):
+    """Loads the parsed config and its lookup index, using a cached copy when the config file has not changed.
+
+    The cache is stored next to the config file as `<config file>.idx.pkl` and is keyed by the modification time and
+    size of the config file. If the cache can't be written the config is still parsed and used.
+
+    Parameters
+    ----------
+    _config_file : str
+        Path to the configuration file
+
+    Returns
+    ----------
+    A tuple of the interface configs and the lookup index from `build_config_index`.
+    """
+
+    key = (_CACHE_VERSION, _CONFIG_HASH) + _config_key(_config_file)
+    cache_file = _config_file + ".idx.pkl"
+
+    try:
+        with open(cache_file, "rb") as file:
+            cache = pickle.load(file)
+        if cache['key'] == key:
+            log.debug("Using cached config %s", cache_file)
+            return cache['interface_config'], cache['index']
+    except Exception:
+        # A missing, corrupt or foreign cache just means the config is parsed again
+        pass
 
+    log.debug("Parsing config %s", _config_file)
 
     ouis = []
     interface_config = []
 
-    parse_config_file(results.config, ouis, interface_config)
-    
+    parse_config_file(_config_file, ouis, interface_config)
+    index = build_config_index(ouis, interface_config)
 
-    mac_index = check_interface_macs(results.inter, ouis)
+    # Write to a temp file and swap it in so a concurrent run never reads a partial cache
+    try:
+        fd, tmp_file = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(cache_file)))
+        try:
+            with os.fdopen(fd, "wb") as file:
+                pickle.dump({'key': key, 'interface_config': interface_config, 'index': index}, file, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_file, cache_file)
+        except OSError:
+            os.remove(tmp_file)
+            raise
+    except OSError:
+        pass
 
-    if mac_index != -99 and apply_default_config:
-        # Check if the interface config matches the purposed config or if there is a default config, quit if it does.
-        if check_interface_config(results.inter, interface_config[mac_index]) and not apply_default_config:
-            quit()
+    return interface_config, index
 
-        config_interface(interface_config[mac_index], results.inter)
+def _config_key(_config_file):
+    """Returns the modification time and size of the config file, used to tell when it has changed"""
 
+    st = os.stat(_config_file)
+    return (st.st_mtime_ns, st.st_size)
 
 def parse_config_file(_config_file, _ouis, _interface_config):
     """Parses the purposed configuration file
 
-    If the default wildcard is used then the global variable apply_default_config is set to True
+    If the default wildcard is used it is stored as `%default%` with the mac addresses of its section
     This will apply a default config to a interface. If not used then we ignore an interface that doesn't match
 
     Parameters
@@ -77,122 +522,250 @@ def parse_config_file(_config_file, _ouis, _interface_config):
     _interface_config : array of lists
         The config for the matching interfaces. Each config section is a index of the array stored in a list
 
+    Raises
+    ----------
+    ValueError
+        If the last mac address section has no config section after it.
     """
 
-    file = open(_config_file, "r")
-    line = file.readline()
-
-    while line:
-        oui = []
-        cmds = []
+    with open(_config_file, "r") as file:
+        lines = file.read().splitlines()
 
-        while line:
-            if line == '\n':
-                break
-            if line == "%DEFAULT%\n":
-                global apply_default_config
-                apply_default_config = True
+    # Group the file into sections separated by blank lines
+    sections = []
+    section = []
 
-            oui.append(clean_mac_address(line))    
-            line = file.readline()
+    for line in lines:
+        line = line.strip()
 
-        _ouis.append(oui)    
-        line = file.readline()
+        if line:
+            section.append(line)
+        elif section:
+            sections.append(section)
+            section = []
 
-        while line:
-            if line == '\n':
-                break
+    if section:
+        sections.append(section)
 
-            cmds.append(line.strip())    
-            line = file.readline()
+    if len(sections) % 2:
+        raise ValueError("no config after the mac addresses {}".format(", ".join(sections[-1])))
 
+    # Sections alternate between the mac addresses and the config to apply for them
+    for ouis, cmds in zip(sections[0::2], sections[1::2]):
+        _ouis.append([clean_mac_address(oui) for oui in ouis])
         _interface_config.append(cmds)
 
-        line = file.readline() 
- 
-    file.close()
+def build_config_index(_ouis, _interface_config):
+    """Builds lookup tables from the parsed mac addresses and OUIs so each mac address on an interface is a single lookup
 
-"""
+    When the same mac address or OUI is in more than one section, the first section in the config file is used.
 
-"""
-def check_interface_macs(_interface, _ouis):
+    Parameters
+    ----------
+    _ouis : array of lists
+        All of the ouis or mac addresses. Each section is a index of the array stored in a list
+    _interface_config : array of lists
+        The config for the matching interfaces. Each config section is a index of the array stored in a list
+
+    Raises
+    ----------
+    ValueError
+        If an entry is not a full mac address, an OUI or the default wildcard.
+
+    Returns
+    ----------
+    A dict with `exact` mapping full mac addresses to their config index, `oui` holding a table for each OUI length
+    (9, 7 and 6 hex digits, longest first) mapping OUIs to their config index, `default` holding the index of the default config, or -99 if there is no default config, and `config_hashes`
+    holding the `config_hash` of the config lines for each config index.
+    """
+
+    # OUIs can be MA-S (36 bit), MA-M (28 bit) or MA-L (24 bit) blocks, longest is checked first
+    index = {'exact': {}, 'oui': {9: {}, 7: {}, 6: {}}, 'default': -99}
+    index['config_hashes'] = [config_hash(config) for config in _interface_config]
+
+    # Full mac addresses and OUIs are kept apart by their length
+    classify = dict(index['oui'])
+    classify[12] = index['exact']
+
+    for section, ouis in enumerate(_ouis):
+        for oui in ouis:
+            if oui == "%default%":
+                if index['default'] == -99:
+                    index['default'] = section
+                continue
+
+            try:
+                if not set(oui) <= _HEX_DIGITS:
+                    raise ValueError
+                classify[len(oui)].setdefault(oui, section)
+            except (KeyError, ValueError):
+                raise ValueError("{!r} is not a full mac address or OUI".format(oui))
+
+    return index
+
+def fetch_interface_state(_ctx, _interfaces):
+    """Pulls the mac address table and the running config for interfaces in a single call to the switch.
+
+    Parameters
+    ----------
+    _ctx : Ctx
+        The switch connection and loaded config
+    _interfaces : list
+        The interfaces to check
+
+    Returns
+    ----------
+    A list with a tuple of the mac address table response and the running config response for each interface.
+    """
+
+    cmds = []
+    for interface in _interfaces:
+        cmds += ["show mac address-table interface " + interface, "show running-config interfaces " + interface]
+
+    response = runCMD(_ctx, cmds, 'text')
+
+    if len(response) != len(cmds) + 1:
+        raise ValueError("expected {} responses from the switch, got {}".format(len(cmds) + 1, len(response)))
+
+    return list(zip(response[1::2], response[2::2]))
+
+def check_interface_macs(_mac_table, _index):
     """Checks to see if any OUIs or mac addresses are located on an interface
 
-    Pulls all mac address from the mac address table for an interface. 
+    Uses all mac address from the mac address table for an interface. 
 
     Parameters
     ----------
-    _interface : str
-        The interface to check
-    _ouis : array of lists
-        All of the ouis or mac addresses. Each section is a index of the array stored in a list
+    _mac_table : dict
+        The `show mac address-table interface` text response for the interface to check
+    _index : dict
+        The lookup tables from `build_config_index`
 
     Returns
     ----------
-    The index of the array in which the OUI or mac address matches from the _oui array.
+    The index of the config in which the OUI or mac address matches. Full mac addresses are matched before OUIs, and
+    longer OUIs before shorter ones.
     Will return a -99 if no mac address, OUI or not using a default config.
     """
 
-    mac_addresses = []
+    oui_match = None
+    debug = log.isEnabledFor(logging.DEBUG)
 
-    response = runCMD(["show mac address-table interface " + _interface])
+    # Only probe the OUI lengths the config uses
+    oui_tables = [(length, table) for length, table in _index['oui'].items() if table]
 
-    for mac_address in response[1]['unicastTable']['tableEntries']:
+    # The text output avoids building a dict for every entry in the mac address table, and scanning it lazily means
+    # the rest of the table is never looked at once a full mac address matches
+    output = _mac_table["output"]
 
-        mac_addresses.append(clean_mac_address(mac_address['macAddress']).encode("utf-8"))
-    
-    for index, ouis in enumerate(_ouis):
-        # Search for more specific mac address first
-        if any(item in mac_addresses for item in ouis):
-            return index
+    # Only the unicast table is checked, multicast group mac addresses are not devices on the port
+    end = output.find(_MULTICAST_HEADER)
+    if end == -1:
+        end = len(output)
 
-        for oui in ouis:
-            if any([ mac.startswith(oui) for mac in mac_addresses]):
-                return index
+    for match in _MAC_RE.finditer(output, 0, end):
+        mac = match.group(1).translate(_MAC_DELETE).lower()
+
+        if debug:
+            log.debug("Found mac address %s", mac)
 
-    if apply_default_config:
-        if any(item in ["%default%"] for item in ouis):
-            return index
+        # A full mac address is the most specific match, stop looking as soon as one is found
+        exact_match = _index['exact'].get(mac)
+        if exact_match is not None:
+            return exact_match
 
-    return -99
+        if oui_match is None:
+            for length, table in oui_tables:
+                oui_match = table.get(mac[:length])
+                if oui_match is not None:
+                    break
 
-def check_interface_config(_interface, _int_config):
+    if oui_match is not None:
+        return oui_match
+
+    return _index['default']
+
+def check_interface_config(_running_config, _config_hash):
     """Checks to see if the interface already has the correct config
 
     Parameters
     ----------
-    _interface : str
-        The interface to check
-    _int_config : list
-        What the config of the interace should be
+    _running_config : dict
+        The `show running-config interfaces` text response for the interface to check
+    _config_hash : int
+        What the config of the interace should be, from the `config_hashes` of the config index
 
     Returns
     ----------
     Bool. True if the config is the same. False the configs do not match and the interface needs to be configured.
     """
 
-    response = runCMD(["show running-config interfaces  " + _interface], 'text')
+    return config_hash(running_config_lines(_running_config)) == _config_hash
+
+def running_config_lines(_running_config):
+    """Returns the stripped config lines of a `show running-config interfaces` text response, without the
+    `interface` line.
+    """
 
-    # Clean up config from switch and put it into a list
-    config = response[1]["output"].split("\n")
-    config = [line.strip().encode("utf-8") for line in config if line]
-    del config[:1]
+    return [line.strip() for line in _running_config["output"].splitlines()[1:] if line.strip()]
 
-    return set(config) == set(_int_config)
+def config_hash(_config):
+    """Hashes interface config lines so configs can be compared as a single number.
 
-def config_interface(_config, _interface):
-    """Sets up command to send to the switch to configure the interface.
+    The lines are stripped and sorted first, as the switch may show them in a different order than the config file.
+    Repeated lines are only counted once, as the switch never shows a line twice.
 
     Parameters
     ----------
     _config : list
-        The config to apply
-    _interface : str
-        The interface to configure
+        The config lines
+
+    Returns
+    ----------
+    A 64 bit int
+    """
+
+    return _hash_bytes(b"\n".join(sorted(set(line.strip().encode("utf-8") for line in _config if line.strip()))))
+
+def config_interface(_ctx, _configs):
+    """Sets up command to send to the switch to configure the interfaces.
+
+    If an interface only lacks some of the config lines, just those lines are added. If it has config that is not in
+    the config to apply, the interface is set back to its defaults first.
+
+    Parameters
+    ----------
+    _ctx : Ctx
+        The switch connection and loaded config
+    _configs : dict
+        The interfaces to configure, each with a tuple of the config to apply and its current config lines
 
+    Returns
+    ----------
+    A list of the interfaces that config was sent for. Interfaces that already have every line are left out.
     """
 
-    runCMD(["configure", "default interface " + _interface, "interface " + _interface] + _config)
+    cmds = ["configure"]
+    configured = []
+
+    for interface, (config, current) in _configs.items():
+        have = set(current)
+        want = set(line.strip() for line in config)
+
+        if have - want:
+            cmds += ["default interface " + interface, "interface " + interface] + config
+        else:
+            missing = [line for line in config if line.strip() not in have]
+            if not missing:
+                continue
+            cmds += ["interface " + interface] + missing
+
+        configured.append(interface)
+
+    if configured:
+        runCMD(_ctx, cmds)
+
+    return configured
 
 
 def clean_mac_address(mac):
@@ -208,31 +781,34 @@ def clean_mac_address(mac):
     The sanitized mac address
     """
 
-    return mac.replace(':','').replace('.','').replace('-','').strip().lower()
+    return mac.translate(_MAC_DELETE).strip().lower()
 
-def runCMD(_cmd, _format='json'):
+def runCMD(_ctx, _cmd, _format='json'):
     """Sends a command to the switch.
 
     Parameters
     ----------
+    _ctx : Ctx
+        The switch connection and loaded config
     _cmd : list
         The command to be ran.
     _format : str, optional
         What format do you want in return. Default is json. Some commands like `show run` do not support json, you have to set the 
         format to text for it to work.
 
+    Raises
+    ----------
+    EapiError
+        If the switch returns an error for a command.
+    OSError, http.client.HTTPException, ValueError
+        If the switch can't be reached or the response can't be read.
+
     Returns
     ----------
     The output from the switch.
     """
 
-    try:
-        return switch.runCmds( version = 1, cmds = ["enable"] + _cmd, format=_format)
-    except:
-        print("Error with connecting to switch! Please try again.")
-        quit()
+    return _ctx.switch.runCmds( version = 1, cmds = ["enable"] + _cmd, format=_format)
 
 if __name__ == "__main__":
-    if sys.version_info[:2] <= (2, 7):
-        input = raw_input
     main()
\ No newline at end of file
@@ -0,0 +1,261 @@
+import importlib.util
+import os
+import pickle
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+_spec = importlib.util.spec_from_file_location(
+    "auto_port_config", os.path.join(os.path.dirname(os.path.abspath(__file__)), "auto-port-config.py"))
+auto_port_config = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(auto_port_config)
+
+
+class ParseConfigFileTest(unittest.TestCase):
+
+    def test_mac_section_without_config_is_an_error(self):
+        with tempfile.NamedTemporaryFile("w", suffix=".conf", delete=False) as file:
+            file.write("00:04:f2\n\ndescription Phone\n\n00:11:74\n")
+        self.addCleanup(os.remove, file.name)
+
+        with self.assertRaises(ValueError):
+            auto_port_config.parse_config_file(file.name, [], [])
+
+
+class LoadConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.config_file = os.path.join(directory, "auto-port.conf")
+        self.write_config("description Phone")
+
+    def write_config(self, description):
+        with open(self.config_file, "w") as file:
+            file.write("00:04:f2\n\n{}\n".format(description))
+
+    def test_changed_config_is_parsed_again(self):
+        self.assertEqual(auto_port_config.load_config(self.config_file)[0], [["description Phone"]])
+        self.assertTrue(os.path.exists(self.config_file + ".idx.pkl"))
+
+        self.write_config("description AP")
+
+        self.assertEqual(auto_port_config.load_config(self.config_file)[0], [["description AP"]])
+
+    def test_cache_from_another_version_is_ignored(self):
+        auto_port_config.load_config(self.config_file)
+
+        with open(self.config_file + ".idx.pkl", "rb") as file:
+            cache = pickle.load(file)
+        cache['key'] = (auto_port_config._CACHE_VERSION - 1,) + cache['key'][1:]
+        cache['interface_config'] = [["description Stale"]]
+        with open(self.config_file + ".idx.pkl", "wb") as file:
+            pickle.dump(cache, file)
+
+        self.assertEqual(auto_port_config.load_config(self.config_file)[0], [["description Phone"]])
+
+    def test_corrupt_cache_is_ignored(self):
+        with open(self.config_file + ".idx.pkl", "wb") as file:
+            # Refers to a module that doesn't exist, so loading it raises ImportError
+            file.write(b"cno_such_module\nthing\n.")
+
+        self.assertEqual(auto_port_config.load_config(self.config_file)[0], [["description Phone"]])
+
+
+class BuildConfigIndexTest(unittest.TestCase):
+
+    def test_bad_entries_are_an_error(self):
+        for oui in ["0004f2a1", "0004g2", "e4d12400123z", "0x04f2"]:
+            with self.assertRaises(ValueError, msg=oui):
+                auto_port_config.build_config_index([[oui]], [["description Phone"]])
+
+
+class CheckInterfaceMacsTest(unittest.TestCase):
+
+    def setUp(self):
+        ouis = [["0004f2"], ["e4d124001234"], ["%default%"]]
+        interface_config = [["description Phone"], ["description AP"], ["description UserPort"]]
+        self.index = auto_port_config.build_config_index(ouis, interface_config)
+
+    def test_exact_match_on_second_mac_beats_oui_on_first(self):
+        mac_table = {"output": "  10    0004.f200.0001    DYNAMIC     Et5        1       0:00:12 ago\n"
+                               "  10    e4d1.2400.1234    DYNAMIC     Et5        1       0:00:12 ago\n"}
+
+        self.assertEqual(auto_port_config.check_interface_macs(mac_table, self.index), 1)
+
+    def test_multicast_macs_are_ignored(self):
+        mac_table = {"output": "          Mac Address Table\n"
+                               "  10    aabb.cc00.0001    DYNAMIC     Et5        1       0:00:12 ago\n"
+                               "          Multicast Mac Address Table\n"
+                               "  10    0004.f200.0001    STATIC      Et5\n"}
+
+        self.assertEqual(auto_port_config.check_interface_macs(mac_table, self.index), 2)
+
+    def test_longest_oui_wins(self):
+        ouis = [["70b3d5"], ["70b3d50"], ["8c1f64f5a"]]
+        index = auto_port_config.build_config_index(ouis, [["description A"], ["description B"], ["description C"]])
+
+        self.assertEqual(auto_port_config.check_interface_macs({"output": "70b3.d501.2345"}, index), 1)
+        self.assertEqual(auto_port_config.check_interface_macs({"output": "70b3.d511.2345"}, index), 0)
+        self.assertEqual(auto_port_config.check_interface_macs({"output": "8c1f.64f5.a001"}, index), 2)
+
+
+class CheckInterfaceConfigTest(unittest.TestCase):
+
+    def test_repeated_config_line_matches_running_config(self):
+        config_hash = auto_port_config.config_hash(["description AP", "switchport mode trunk", "description AP"])
+        running_config = {"output": "interface Ethernet5\n   switchport mode trunk\n   description AP\n"}
+
+        self.assertTrue(auto_port_config.check_interface_config(running_config, config_hash))
+
+
+class ConfigInterfaceTest(unittest.TestCase):
+
+    class Switch():
+
+        def __init__(self):
+            self.cmds = []
+
+        def runCmds(self, version, cmds, format='json'):
+            self.cmds.append(cmds)
+            return [{}] * len(cmds)
+
+    def setUp(self):
+        self.ctx = auto_port_config.Ctx(self.Switch(), [], {})
+
+    def test_only_missing_lines_are_sent(self):
+        configured = auto_port_config.config_interface(
+            self.ctx, {"Ethernet5": (["description AP", "switchport mode trunk"], ["description AP"])})
+
+        self.assertEqual(configured, ["Ethernet5"])
+        self.assertEqual(self.ctx.switch.cmds, [["enable", "configure", "interface Ethernet5", "switchport mode trunk"]])
+
+    def test_nothing_is_sent_when_no_lines_are_missing(self):
+        configured = auto_port_config.config_interface(
+            self.ctx, {"Ethernet5": (["description AP"], ["description AP"])})
+
+        self.assertEqual(configured, [])
+        self.assertEqual(self.ctx.switch.cmds, [])
+
+
+class EapiClientTest(unittest.TestCase):
+
+    def test_timeout_is_not_retried(self):
+        socket_path = os.path.join(tempfile.mkdtemp(), "eapi.sock")
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(4)
+        self.addCleanup(os.remove, socket_path)
+        self.addCleanup(server.close)
+
+        client = auto_port_config.EapiClient()
+        client.connection = auto_port_config.UnixHTTPConnection(socket_path, 0.2)
+        self.addCleanup(client.connection.close)
+
+        with self.assertRaises(socket.timeout):
+            client.runCmds(1, ["enable"])
+
+        # Only one connection was made to the switch
+        server.setblocking(False)
+        server.accept()[0].close()
+        with self.assertRaises(BlockingIOError):
+            server.accept()
+
+
+class RunPendingTest(unittest.TestCase):
+
+    class Switch():
+
+        def __init__(self, error):
+            self.error = error
+            self.calls = 0
+
+        def runCmds(self, version, cmds, format='json'):
+            self.calls += 1
+            raise self.error
+
+    def test_switch_error_retries_each_interface(self):
+        ctx = auto_port_config.Ctx(self.Switch(auto_port_config.EapiError("bad interface")), [], {})
+
+        replies = auto_port_config._run_pending(["Ethernet5", "Ethernet6"], ctx)
+
+        self.assertEqual(replies, dict.fromkeys(["Ethernet5", "Ethernet6"], "error bad interface"))
+        self.assertEqual(ctx.switch.calls, 3)
+
+    def test_timeout_fails_the_whole_batch_once(self):
+        ctx = auto_port_config.Ctx(self.Switch(socket.timeout("timed out")), [], {})
+
+        replies = auto_port_config._run_pending(["Ethernet5", "Ethernet6"], ctx)
+
+        self.assertEqual(replies, dict.fromkeys(["Ethernet5", "Ethernet6"], "error timed out"))
+        self.assertEqual(ctx.switch.calls, 1)
+
+
+class ServeTest(unittest.TestCase):
+
+    class Switch():
+
+        def __init__(self):
+            # An unexpected response body
+            self.response = [{}]
+
+        def runCmds(self, version, cmds, format='json'):
+            return self.response
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.socket_path = os.path.join(directory, "auto-port.sock")
+        config_file = os.path.join(directory, "auto-port.conf")
+        with open(config_file, "w") as file:
+            file.write("%DEFAULT%\n\ndescription UserPort\n")
+
+        interface_config, index = auto_port_config.load_config(config_file)
+        self.ctx = auto_port_config.Ctx(self.Switch(), interface_config, index)
+        threading.Thread(target=auto_port_config.serve, args=(self.socket_path, config_file, self.ctx), daemon=True).start()
+
+        while not os.path.exists(self.socket_path):
+            time.sleep(0.01)
+
+    def connect(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        conn.settimeout(2)
+        conn.connect(self.socket_path)
+        self.addCleanup(conn.close)
+        return conn
+
+    def test_silent_client_does_not_block_others_and_errors_are_replied(self):
+        self.connect()
+
+        start = time.monotonic()
+        for _ in range(2):
+            with self.assertLogs("autoport", "WARNING"):
+                conn = self.connect()
+                conn.sendall(b"Ethernet5\n")
+                self.assertTrue(conn.recv(256).startswith(b"error"))
+
+        self.assertLess(time.monotonic() - start, 1)
+
+    def test_daemon_keeps_running_after_an_unexpected_error(self):
+        self.ctx.switch.response = None
+
+        for _ in range(2):
+            with self.assertLogs("autoport", "ERROR"):
+                conn = self.connect()
+                conn.sendall(b"Ethernet5\n")
+                self.assertTrue(conn.recv(256).startswith(b"error"))
+
+
+class InterfaceNameTest(unittest.TestCase):
+
+    def test_single_interfaces_are_accepted(self):
+        for name in ["Ethernet5", "Ethernet1/2", "Ethernet1/2.100", "Port-Channel10"]:
+            self.assertTrue(auto_port_config._INTERFACE_RE.match(name), name)
+
+    def test_ranges_are_rejected(self):
+        for name in ["Ethernet1-48", "Ethernet1/1-4", "Ethernet1,2"]:
+            self.assertFalse(auto_port_config._INTERFACE_RE.match(name), name)
+
+
+if __name__ == "__main__":
+    unittest.main()